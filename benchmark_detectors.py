@@ -0,0 +1,73 @@
+##########
+#
+# Times each detector in images_findpip_server.py against the scans in the
+# examples folder and counts how many pictures each one finds.
+#
+# Usage: python3 ./benchmark_detectors.py [number_of_runs]
+#
+# Created: 2026-10-19
+##########
+
+# Python built-in modules
+import glob
+import os
+import sys
+import time
+
+import cv2
+
+from images_findpip_server import DETECTORS
+
+# Number of receipe cards in each example scan. See examples/README.md
+EXPECTED = {
+    'example_01_source.jpg': 3,
+    'example_02_source.jpg': 3,
+}
+
+def countCards(contours):
+    # Count the contours that look like a receipe card (four corners)
+
+    numcards = 0
+
+    for loopcnt, pos in contours:
+        peri = cv2.arcLength(pos, True)
+        approx = cv2.approxPolyDP(pos, 0.02 * peri, True)
+
+        if len(approx) == 4:
+            numcards += 1
+
+    return numcards
+
+def main():
+
+    runs = 20
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples')
+
+    print("{:<12} {:<24} {:>10} {:>10} {:>8} {:>9}".format('Detector', 'Image', 'ms/run', 'Contours', 'Cards', 'Expected'))
+
+    for srcimage in sorted(glob.glob(os.path.join(folder, '*', '*_source.jpg'))):
+
+        imgorig = cv2.imread(srcimage)
+
+        # Same resizing as _processImage()
+        ratio = 500.0 / imgorig.shape[1]
+        dim = (500, int(imgorig.shape[0] * ratio))
+        img = cv2.resize(imgorig, dim, interpolation = cv2.INTER_AREA)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        name = os.path.basename(srcimage)
+
+        for detector in sorted(DETECTORS):
+
+            start = time.perf_counter()
+            for i in range(runs):
+                contours = DETECTORS[detector](gray)
+            elapsed = (time.perf_counter() - start) * 1000.0 / runs
+
+            print("{:<12} {:<24} {:>10.2f} {:>10} {:>8} {:>9}".format(detector, name, elapsed, len(contours), countCards(contours), EXPECTED.get(name, '?')))
+
+if __name__ == '__main__':
+    main()
@@ -3,31 +3,655 @@
 # Python 3.6 version of the script
 #
 # Created: 2018-01-02
-# Modified: 2018-03-03 2313
+# Modified: 2026-10-19 0900
 ##########
 
 # Python built-in modules
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import cProfile
+import io
 import math
+import multiprocessing
 import numpy as np
 import os
+import pstats
 import re
 import select
 import shutil
 import socket
 import tarfile
 import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
 import urllib.error
 import urllib.parse
 import urllib.request
+import zlib
 
 import cv2
+from PIL import Image
+
+#####
+# Detector backends
+#
+# Each detector is given the resized (500 pixels wide) grayscale image and
+# returns a list of (loopcnt, contour) tuples, one for each picture it thinks
+# it found. <loopcnt> is used to give each output image a unique name.
+#
+# Use the option detector<name> to pick the detector for a request.
+# Example: detectorthreshold
+
+def detectAdaptive(gray):
+    # Local (adaptive) threshold followed by morphology.
+    # Handles uneven lighting across the scanner glass better than a single
+    # global threshold.
+
+    gray = cv2.GaussianBlur(gray, (5,5), 0)
+
+    mask = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 101, -10)
+
+    return _maskContours(_cleanMask(_orientMask(mask), 9))
+
+def detectAutoCanny(gray):
+    # Canny edge detection with the thresholds picked from the median
+    # brightness of the image instead of the fixed 100/200
+
+    gray = cv2.GaussianBlur(gray, (11,11), 0)
+
+    sigma = 0.33
+    median = np.median(gray)
+    lower = int(max(0, (1.0 - sigma) * median))
+    upper = int(min(255, (1.0 + sigma) * median))
+
+    edge = cv2.Canny(gray, lower, upper)
+
+    # Close small gaps in the edges so each picture has one outline
+    edge = cv2.dilate(edge, np.ones((3,3), np.uint8), iterations = 1)
+
+    return _maskContours(edge)
+
+def detectCanny(gray):
+    # The original detector. Works best with a flat black background.
+
+    # Add a blur to remove some of the noise
+    # Image noise is random variation of brightness or color.
+    # More info: https://en.wikipedia.org/wiki/Image_noise
+    gray = cv2.GaussianBlur(gray, (11,11), 0)
+
+    # Find the contours of the receipe cards
+    edge = cv2.Canny(gray, 100, 200)
+    contours = cv2.findContours(edge.copy(), 1, 1)[-2]
+
+    # Each receipe card has two contours. Don't know why.
+    #
+    # The first contour is an exact copy of the card in the original image.
+    # The second contour is rotated slightly and has a small border that makes
+    #     it easier for the OCR script to find the text near the edge of the image.
+    #
+    # Skip the first contour.
+    return [(loopcnt, pos) for loopcnt, pos in enumerate(contours) if loopcnt % 2 == 1]
+
+def detectThreshold(gray):
+    # Global (Otsu) threshold followed by morphology.
+    # Cheapest detector. Meant for a solid background on a flatbed scanner.
+
+    gray = cv2.GaussianBlur(gray, (5,5), 0)
+
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    return _maskContours(_cleanMask(_orientMask(mask), 25))
+
+def _cleanMask(mask, opensize):
+    # Fill in the text on each picture and remove anything narrower than
+    # <opensize> pixels (specks, the edge of the scanner lid, etc)
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9,9))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (opensize,opensize))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    return mask
+
+def _maskContours(mask):
+    # Returns the outer contour of each blob in <mask> that is big enough
+    # to be a picture
+
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+    # Ignore anything smaller than 1% of the image
+    minarea = 0.01 * mask.shape[0] * mask.shape[1]
+
+    contours = [pos for pos in contours if cv2.contourArea(pos) >= minarea]
+
+    return list(enumerate(contours))
+
+def _orientMask(mask):
+    # Makes sure the pictures are white and the background is black by
+    # looking at the pixels along the edge of the mask
+
+    border = np.concatenate((mask[0], mask[-1], mask[:, 0], mask[:, -1]))
+
+    if np.mean(border) > 127:
+        mask = cv2.bitwise_not(mask)
+
+    return mask
+
+DETECTORS = {
+    'adaptive': detectAdaptive,
+    'autocanny': detectAutoCanny,
+    'canny': detectCanny,
+    'threshold': detectThreshold,
+}
+
+#####
+# Picture extraction
+#
+# These do not use ServerObject so they can also run in the worker processes.
+
+def findCorners(pos):
+    # Finds the corners and dimensions of the object outlined by <pos>
+
+    pts=[]
+    n=len(pos)
+
+    for i in range(n):
+        pts.append(list(pos[i][0]))
+
+    sums={}
+    diffs={}
+    tl=tr=bl=br=0
+
+    for i in pts:
+        x=i[0]
+        y=i[1]
+        sum=x+y
+        diff=y-x
+        sums[sum]=i
+        diffs[diff]=i
+
+    sums=sorted(sums.items())
+    diffs=sorted(diffs.items())
+    n=len(sums)
+
+    # Raises IndexError if <pos> is empty
+    rect=[sums[0][1],diffs[0][1],diffs[n-1][1],sums[n-1][1]]
+    #       top-left   top-right   bottom-left   bottom-right
+
+    h1 = np.sqrt((rect[0][0]-rect[2][0])**2 + (rect[0][1]-rect[2][1])**2)        #height of left side
+    h2 = np.sqrt((rect[1][0]-rect[3][0])**2 + (rect[1][1]-rect[3][1])**2)        #height of right side
+    h = max(h1, h2)
+
+    w1 = np.sqrt((rect[0][0]-rect[1][0])**2 + (rect[0][1]-rect[1][1])**2)        #width of upper side
+    w2 = np.sqrt((rect[2][0]-rect[3][0])**2 + (rect[2][1]-rect[3][1])**2)        #width of lower side
+    w = max(w1, w2)
+
+    return int(w), int(h), rect
+
+def warpPicture(imgorig, arr, w, h, ratio, returncolor):
+    # Cuts the picture with corners <arr> (found on the resized image) out of
+    # the original image and changes it to a top-down view
+
+    # Adjust width and height to match dimensions of
+    # each receipe card on the original image
+    wr = int(w / ratio)
+    hr = int(h / ratio)
+
+    # Adjust pixel coordinates to match orignal image
+    arr_us=[]
+    for a in arr:
+        a[0] = int(math.floor(a[0] / ratio))
+        a[1] = int(math.floor(a[1] / ratio))
+        arr_us.append(list(a))
+
+    arr = arr_us
+
+    # Convert all of the numbers to floats
+    pts1 = np.float32(arr)
+    pts2 = np.float32([[0, 0], [wr, 0], [0, hr], [wr, hr]])
+
+    # Changes perspective to a top-down view (a.k.a.: birds eye view)
+    M = cv2.getPerspectiveTransform(pts1, pts2)
+    dst = cv2.warpPerspective(imgorig, M, (wr, hr))
+
+    if returncolor:
+        # Keep original image colors in output images
+        image = dst
+    else:
+        # Convert output images to grayscale before saving
+        image = cv2.cvtColor(dst, cv2.COLOR_BGR2GRAY)
+
+    return image
+
+class ExtractError(Exception):
+    # Raised by findPictures() when the pictures can not be found. The message
+    # is written to error.txt.
+    pass
+
+def findPictures(imgorig, detector, returncolor, grayfilename, log):
+    # Finds the pictures in <imgorig>. Used by ServerObject._extractPictures()
+    # and extractWorker() so both give the same results.
+    #
+    # Yields a (loopcnt, image) tuple for each picture found.
+    # <grayfilename> is where to save the grayscale image, or None.
+    # <log> is called with each debug message.
+    #
+    # Raises ExtractError
+
+    # Calculate dimensions for resized image
+    ratio = 500.0 / imgorig.shape[1]
+    dim = (500, int(imgorig.shape[0] * ratio))
+
+    # Resizing of image is done here to speed up processing
+    try:
+        img = cv2.resize(imgorig, dim, interpolation = cv2.INTER_AREA)
+    except Exception as e:
+        msg = "Unable to resize image.\n\n{}".format(e)
+
+        log(msg + "\nOriginal dimensions: {}x{}\nNew dimensions: {}x{}".format(imgorig.shape[0], imgorig.shape[1], dim[0], dim[1]))
+
+        raise ExtractError(msg)
+
+    log("Image copied and resized.")
+
+    # Convert to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    if grayfilename:
+        # Save the grayscale version to disk
+        try:
+            cv2.imwrite(grayfilename, gray)
+        except Exception as e:
+            msg = "Unable to save grayscale image.\nDestination file: {}\n{}".format(os.path.basename(grayfilename), e)
+
+            log(msg)
+
+            raise ExtractError(msg)
+
+        log("Grayscale image created")
+
+    log("Detector: {}".format(detector))
+
+    # Find the contours of the receipe cards
+    contours = DETECTORS[detector](gray)
+
+    if len(contours) < 1:
+        # Unable to pull anything out of the image if no contours were found
+        raise ExtractError("No contours found to retreive")
+
+    log("Number of contours: {}".format(len(contours)))
+
+    # Process all found contours
+    # <loopcnt> gives each output image a unique name
+    for loopcnt, pos in contours:
+
+        log("Loop: {}".format(loopcnt))
+
+        # Get length of the contour in pixels
+        # <peri> is a float
+        peri = cv2.arcLength(pos, True)
+
+        # Approximates a polygonal curve(s) with the specified precision
+        # More info: https://docs.opencv.org/2.4/modules/imgproc/doc/structural_analysis_and_shape_descriptors.html#approxpolydp
+        approx = cv2.approxPolyDP(pos, 0.02 * peri, True)
+
+        # Find the corners and dimensions of the object
+        try:
+            w, h, arr = findCorners(approx)
+        except IndexError as e:
+            raise ExtractError("Unable to find the corners of contour {}.\n{}".format(loopcnt, e))
+
+        # Only process contours that have a valid dimension
+        if w > 0 and h > 0:
+
+            # Cut the receipe card out of the original image
+            yield loopcnt, warpPicture(imgorig, arr, w, h, ratio, returncolor)
+
+        else:
+            log("\nContur width and/or height are to small to process.")
+
+#####
+# Worker processes
+#
+# Images are handed to the worker processes through memory mapped files
+# instead of being pickled. Only a descriptor (filename, shape, dtype) is sent
+# between the processes. The files live in a RAM-backed folder when one is
+# available (/dev/shm on Linux) so nothing is written to the SD card.
+
+def attachSegment(desc, mode = 'r'):
+    # Maps the image described by <desc> into memory without copying it
+
+    filename, shape, dtype = desc
+
+    return np.memmap(filename, dtype = dtype, mode = mode, shape = shape)
+
+def createSegment(filename, image):
+    # Copies <image> into a new memory mapped file and returns its descriptor
+
+    seg = np.memmap(filename, dtype = image.dtype, mode = 'w+', shape = image.shape)
+    seg[...] = image
+    seg.flush()
+
+    desc = (filename, image.shape, image.dtype.str)
+
+    del seg
+
+    return desc
+
+def extractWorker(srcdesc, segdir, detector, returncolor, grayfilename):
+    # Runs in a worker process. Finds the pictures in the image described by
+    # <srcdesc> and puts each one in its own segment in <segdir>.
+    #
+    # Returns a tuple of:
+    #   The debug messages from findPictures()
+    #   A list of (loopcnt, descriptor) tuples, one for each picture
+    #   The ExtractError message, or None if there was no error
+
+    messages = []
+    cards = []
+
+    try:
+        for loopcnt, image in findPictures(attachSegment(srcdesc), detector, returncolor, grayfilename, messages.append):
+            cards.append((loopcnt, createSegment(os.path.join(segdir, 'card_{}'.format(loopcnt)), image)))
+
+    except ExtractError as e:
+        return messages, cards, str(e)
+
+    return messages, cards, None
+
+#####
+# Duplicate detection
+
+def dHash(image):
+    # Returns a 64 bit difference hash (dHash) of <image> as an int.
+    # Pictures that look alike have hashes that differ in only a few bits.
+
+    if len(image.shape) > 2:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # 9x8 so each row gives 8 left/right comparisons
+    small = cv2.resize(image, (9, 8), interpolation = cv2.INTER_AREA)
+
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+class HashIndex:
+    # Persistent index of the dHash of every picture the server has sent out.
+    #
+    # Lookups use multi-index hashing: the 64 bit hash is split into
+    # <threshold + 1> bands. Two hashes that differ in <threshold> bits or less
+    # must match exactly in at least one band, so only the hashes sharing a
+    # band with the one being looked up need to be compared.
+    #
+    # The file is a plain list of 8 byte little endian hashes. New hashes are
+    # appended to it as they are added.
+
+    def __init__(self, filename, threshold):
+        self.filename = filename
+        self.threshold = threshold
+
+        # Split the 64 bits into <threshold + 1> bands of nearly equal width
+        numbands = threshold + 1
+        self.bands = []
+        shift = 0
+        for i in range(numbands):
+            width = 64 // numbands + (1 if i < 64 % numbands else 0)
+            self.bands.append((shift, (1 << width) - 1))
+            shift += width
+
+        # One dict per band: band value -> list of hashes
+        self.tables = [{} for b in self.bands]
+
+        self.count = 0
+
+        if os.path.isfile(self.filename):
+            for h in np.fromfile(self.filename, dtype='<u8').tolist():
+                self._insert(h)
+
+    def _insert(self, h):
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            table.setdefault((h >> shift) & mask, []).append(h)
+
+        self.count += 1
+
+    def add(self, h):
+        # Add <h> to the index and save it to disk
+
+        self._insert(h)
+
+        with open(self.filename, 'ab') as f:
+            f.write(np.array([h], dtype='<u8').tobytes())
+        f.close()
+
+    def find(self, h):
+        # Returns the Hamming distance to the closest hash in the index that
+        # is within <self.threshold> bits of <h>, or None if there isn't one
+
+        best = None
+
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            for other in table.get((h >> shift) & mask, ()):
+                dist = bin(h ^ other).count('1')
+
+                if dist <= self.threshold and (best is None or dist < best):
+                    best = dist
+
+                    if best == 0:
+                        return best
+
+        return best
+
+#####
+# Working area
+
+class QuotaExceeded(Exception):
+    # Raised when a request uses more of the working area than it is allowed
+    pass
+
+class WorkArea:
+    # Manages the folders each request works in.
+    #
+    # Every request gets its own folder under <root>. The folder and its
+    # .tar.gz file are removed when the request's with-block ends, even if
+    # an exception was raised. Folders left behind by a crash are removed by
+    # sweep().
+
+    def __init__(self, root, requestquota, globalquota, sweepinterval):
+        self.root = root
+        self.sweepinterval = sweepinterval
+
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+        # The quotas can not be bigger than the disk <root> is on. Otherwise
+        # the disk fills up before the quota is reached. 10% of the disk is
+        # kept free for the small files that are not counted (debug.txt,
+        # error.txt, manifest.txt and the profiling results).
+        self.globalquota = min(globalquota, int(shutil.disk_usage(self.root).total * 0.9))
+        self.requestquota = min(requestquota, self.globalquota)
+
+        # Every folder/file created by the server starts with this
+        self.prefix = 'images_findpip_'
+
+        # Folders currently in use
+        self.active = set()
+
+        # Bytes written to each folder in use and to all of them together.
+        # Kept as running totals so the folders never have to be walked.
+        # Pages of a multi-page image add to them at the same time.
+        self.used = {}
+        self.total = 0
+        self.lock = threading.Lock()
+
+        self.lastsweep = 0
+        self.numswept = 0
+
+    def add(self, path, nbytes):
+        # Adds <nbytes> just written to the request folder <path>.
+        # Raises QuotaExceeded if <path> or the whole working area is too big
+
+        with self.lock:
+            self.used[path] += nbytes
+            self.total += nbytes
+
+            used = self.used[path]
+            total = self.total
+
+        if used > self.requestquota:
+            raise QuotaExceeded("Request used {} bytes of working space. The limit is {} bytes.".format(used, self.requestquota))
+
+        if total > self.globalquota:
+            raise QuotaExceeded("Server is out of working space. {} of {} bytes in use.".format(total, self.globalquota))
+
+    def release(self, path, nbytes = None):
+        # Takes <nbytes> deleted from the request folder <path> off the totals.
+        # None = Everything counted for <path>
+
+        with self.lock:
+            if nbytes is None:
+                nbytes = self.used[path]
+
+            self.used[path] -= nbytes
+            self.total -= nbytes
+
+    @contextlib.contextmanager
+    def request(self, kind = ''):
+        # Creates a folder for one request and removes it when done
+        #
+        # Usage:
+        #   with workarea.request() as tempdir:
+
+        path = tempfile.mkdtemp(prefix = self.prefix + kind, dir = self.root)
+        self.active.add(path)
+
+        with self.lock:
+            self.used[path] = 0
+
+        try:
+            yield path
+        finally:
+            self.active.discard(path)
+            shutil.rmtree(path, ignore_errors = True)
+
+            with self.lock:
+                self.total -= self.used.pop(path)
+
+            # Created by ServerObject._createGzipFile()
+            if os.path.isfile(path + '.tar.gz'):
+                os.unlink(path + '.tar.gz')
+
+    def status(self):
+        # Returns a list of lines describing how much space is in use
+
+        lines = []
+        lines.append("Working area: {}".format(self.root))
+        lines.append("Space used: {} of {} bytes".format(self.total, self.globalquota))
+        lines.append("Per-request limit: {} bytes".format(self.requestquota))
+        lines.append("Active requests: {}".format(len(self.active)))
+
+        if self.lastsweep:
+            lines.append("Last orphan sweep: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.lastsweep))))
+        lines.append("Orphaned files/folders removed: {}".format(self.numswept))
+
+        return lines
+
+    def sweep(self):
+        # Removes folders and .tar.gz files that are not in use by a request
+        # and have not been changed for <sweepinterval> seconds. The age check
+        # keeps another server using the same <root> from losing its folders.
+        # Returns the number removed.
+
+        removed = 0
+
+        oldest = time.time() - self.sweepinterval
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+
+            if not name.startswith(self.prefix):
+                continue
+
+            if path in self.active or path[:-len('.tar.gz')] in self.active:
+                continue
+
+            try:
+                if os.path.getmtime(path) > oldest:
+                    continue
+            except OSError:
+                # Removed by its owner
+                continue
+
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors = True)
+            else:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+
+            removed += 1
+
+        self.lastsweep = time.time()
+        self.numswept += removed
+
+        return removed
+
+    def timeUntilSweep(self):
+        # Seconds until sweep() should be run again
+
+        return max(0, self.lastsweep + self.sweepinterval - time.time())
+
+class FramedSocket:
+    # Wraps a client socket so everything sent is framed using HTTP/1.1
+    # chunked encoding: each piece of data is sent as "<length in hex>\r\n",
+    # the data and "\r\n". finish() sends the zero length chunk that marks
+    # the end of the response so the connection can be used again.
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def finish(self):
+        self.sock.sendall(b'0\r\n\r\n')
+
+    def send(self, data):
+        self.sendall(data)
+
+        return len(data)
+
+    def sendall(self, data):
+        if not data:
+            # A zero length chunk would end the response
+            return
+
+        self.sock.sendall('{:x}\r\n'.format(len(data)).encode('ascii') + bytes(data) + b'\r\n')
+
+class SocketWriter:
+    # Minimal file-like object that sends everything written to it straight
+    # to a socket. Used by tarfile when streaming results to the client.
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def flush(self):
+        # Nothing is buffered here so there is nothing to flush
+        pass
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+        return len(data)
 
 class ServerObject:
 
     def __init__(self):
 
         # Server version
-        self.serverversion = '0.24.6'
+        self.serverversion = '0.32.14'
 
         # Enable/Disable debug mode
         # True = Write debug info to the console and possibly to debug.txt
@@ -47,12 +671,123 @@ class ServerObject:
         # Note: I might expose this option later so leave it here.
         self.returncolor = False
 
+        # Which detector to use to find the pictures.
+        # Must be one of the keys in DETECTORS.
+        self.detector = 'canny'
+
+        # Set to the name given with detector<name> if it is not one of the
+        # keys in DETECTORS. The request is refused instead of quietly using
+        # the default detector.
+        self.baddetector = None
+
+        # Check each extracted picture against the pictures that have already
+        # been sent and flag the duplicates in manifest.txt
+        # True = Hash each picture and write manifest.txt
+        # False = Do not check for duplicates
+        self.dedup = False
+
+        # Leave duplicate pictures out of the .tar.gz file.
+        # Only used if self.dedup == True
+        self.dedupskip = False
+
+        # Where to save the hashes of the pictures that have been sent and
+        # how many bits two hashes can differ by and still be duplicates
+        self.hashindexfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hashindex.bin')
+        self.hashdistance = 4
+
+        # Profile the request and include the results in the .tar.gz file
+        # True = Add profile.txt, profile_opencv.txt, profile.pstats and
+        #        memory.txt to the .tar.gz file
+        # False = Do not profile the request
+        self.profile = False
+
+        # cProfile.Profile for the thread handling the request and for each
+        # page processed by _processPages(). Only set while profiling.
+        self.profiler = None
+        self.threadprofiles = []
+        self.profilestart = 0
+
+        # Keep the connection open for more requests after the results are sent.
+        # The results are framed with HTTP/1.1 chunked encoding so the client
+        # can tell where each response ends.
+        # True = Frame the results and keep the connection open
+        # False = Send the results and close the connection
+        self.keepalive = False
+
+        # Close a connection after it has been idle for this many seconds
+        self.idletimeout = 30
+
+        # Close a connection after it has sent this many requests
+        self.maxrequests = 100
+
+        # Send each extracted picture to the client as soon as it is ready
+        # instead of waiting for the whole image to be processed.
+        # True = Stream the .tar.gz file while processing the image
+        # False = Create the .tar.gz file after processing the image
+        self.streamresults = False
+
+        # Open tarfile object while streaming results to the client
+        self.streamtar = None
+
+        # Set if the client went away while streaming the results
+        self.streamlost = False
+
+        # Number of pages of a multi-page image to process at the same time
+        self.pageworkers = os.cpu_count() or 1
+
+        # Only one page at a time may send a picture or use the hash index
+        self.savelock = threading.Lock()
+
+        # Only one page at a time may write to debug.txt, error.txt or self.debuglog
+        self.loglock = threading.Lock()
+
+        # Number of worker processes used to find the pictures.
+        # 0 = Find the pictures in the server process
+        self.workerprocesses = 0
+
+        # Pool of worker processes. Created by _startWorkers().
+        self.workerpool = None
+        self.workerlock = threading.Lock()
+
+        # Maximum bytes one request may use and maximum bytes all requests may
+        # use together. Each request gets an error.txt file if it goes over.
+        self.requestquota = 128 * 1024 * 1024
+        self.globalquota = 256 * 1024 * 1024
+
+        # Where each request does its work. A RAM-backed (tmpfs) folder keeps
+        # the temp files off of the Raspberry Pi's SD card.
+        # The memory mapped files used by the worker processes also go here.
+        # Docker only gives containers a 64MB /dev/shm, so it is only used if
+        # it can hold self.globalquota.
+        if os.path.isdir('/dev/shm') and shutil.disk_usage('/dev/shm').total >= self.globalquota:
+            self.workroot = '/dev/shm/images_findpip'
+        else:
+            self.workroot = os.path.join(tempfile.gettempdir(), 'images_findpip')
+
+        # How often, in seconds, to remove folders left behind by a crash
+        self.sweepinterval = 600
+
         # Initialize an empty list
         self.debuglog = []
 
         # Where should the server put its ear?
         self.port = 6003
 
+        # Hashes of the pictures that have already been sent
+        self.hashindex = HashIndex(self.hashindexfile, self.hashdistance)
+
+        # Hashes of the new pictures in the current request. See _commitHashes().
+        self.pendinghashes = []
+
+        self.workarea = WorkArea(self.workroot, self.requestquota, self.globalquota, self.sweepinterval)
+
+        # Remove anything left over from the last time the server ran
+        removed = self.workarea.sweep()
+
+        if self.debugmode:
+            self._writeToDebugFile("Working area: {}".format(self.workroot), '')
+            self._writeToDebugFile("Removed {} orphaned files/folders".format(removed), '')
+
         if self.debugmode:
             # IP address and port number
             self._writeToDebugFile("images_findpip Server v{}".format(self.serverversion), '')
@@ -60,6 +795,11 @@ class ServerObject:
             self._writeToDebugFile("Host: {}".format(socket.gethostname()), '')
             self._writeToDebugFile("Port: {}".format(self.port), '')
 
+        if self.workerprocesses > 0:
+            # Start the workers before any sockets are opened so the
+            # worker processes do not inherit them
+            self._startWorkers()
+
         # Create a listening socket
         self.srvsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.srvsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -73,6 +813,18 @@ class ServerObject:
         # This lets the server know it has received all of the data from the client
         self._endmarker = '~~~'
 
+        # Per connection: data received after the last end marker, time of the
+        # last request and number of requests
+        self.recvbuffers = {}
+        self.lastactive = {}
+        self.requestcount = {}
+
+        # Options a request can change. They go back to these values at the
+        # start of each request. See _parseData().
+        self.defaultoptions = {}
+        for name in ('debugmode', 'debugfile', 'returncolor', 'detector', 'baddetector', 'dedup', 'dedupskip', 'streamresults', 'profile', 'keepalive'):
+            self.defaultoptions[name] = getattr(self, name)
+
         if self.debugmode:
             self._writeToDebugFile("Server ready.", '')
 
@@ -88,6 +840,58 @@ class ServerObject:
 
         self.socklist.append(newsock)
 
+        self.recvbuffers[newsock] = b''
+        self.lastactive[newsock] = time.time()
+        self.requestcount[newsock] = 0
+
+    def _checkDuplicate(self, image, outfilename, clientdata):
+        # Looks up <image> in the hash index and records the result in manifest.txt
+        #
+        # Returns:
+        #   The hash of <image> if it is new, otherwise None
+        #   True if the picture should be left out of the results
+
+        if self.debugmode:
+            self._writeToDebugFile("Entered _checkDuplicate()", clientdata)
+
+        h = dHash(image)
+
+        # The same card may have been scanned the other way up
+        dist = None
+        for k in range(4):
+            rh = dHash(np.rot90(image, k)) if k else h
+
+            found = [self.hashindex.find(rh)]
+
+            # Pictures from this request that have not been sent yet
+            for other in self.pendinghashes:
+                d = bin(rh ^ other).count('1')
+                if d <= self.hashindex.threshold:
+                    found.append(d)
+
+            for d in found:
+                if d is not None and (dist is None or d < dist):
+                    dist = d
+
+        if dist is None:
+            status = 'new'
+        elif self.dedupskip:
+            status = 'duplicate (distance {}) omitted'.format(dist)
+        else:
+            status = 'duplicate (distance {})'.format(dist)
+
+        with open(clientdata[1]+'/manifest.txt', 'a') as f:
+            f.write("{}\t{:016x}\t{}\n".format(os.path.relpath(outfilename, clientdata[1]), h, status))
+        f.close()
+
+        if self.debugmode:
+            self._writeToDebugFile("{}: {}".format(os.path.relpath(outfilename, clientdata[1]), status), clientdata)
+
+        if dist is None:
+            return h, False
+
+        return None, self.dedupskip
+
     def _cleanUp(self, clientdata, filename):
 
         # Remove the temp directory
@@ -98,30 +902,62 @@ class ServerObject:
         if os.path.isfile(filename):
             os.unlink(filename)
 
+    def _closeConnection(self, sock, shutdown = True):
+        # Close the connection and forget about the client
+
+        if shutdown:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error as e:
+                print("Debug: Connection closed unexpectedly")
+                print("Reason: {}".format(e))
+            else:
+                print("Debug: Closed connection")
+
+        sock.close()
+
+        # Always remove the client info
+        self.socklist.remove(sock)
+        self.recvbuffers.pop(sock, None)
+        self.lastactive.pop(sock, None)
+        self.requestcount.pop(sock, None)
+
+    def _commitHashes(self, delivered):
+        # Adds the hashes of the new pictures in this request to the hash
+        # index, but only if the results reached the client. A picture that was
+        # never delivered must not count as already seen.
+
+        with self.savelock:
+            if delivered:
+                for h in self.pendinghashes:
+                    self.hashindex.add(h)
+
+            self.pendinghashes = []
+
     def _createGzipFile(self, clientdata):
         # Creates a .tar.zip file containing the contents of <clientdata[1]>
 
-        # Change into the directory that contains the files
-        # to be sent back to the caller.
-        os.chdir(clientdata[1])
-
-        # Create the .tar.gz file with the results
-        filename = os.path.join(tempfile.gettempdir(), clientdata[2]) + '.tar.gz'
+        # Create the .tar.gz file with the results next to the directory
+        # so WorkArea removes it along with the directory
+        filename = clientdata[1] + '.tar.gz'
 
         # Delete the source image since they already have access to it elsewhere
         #
         # Need to check if file exists incase an error occured before the file
         # could be created on the server.
-        if os.path.isfile(clientdata[3]):
+        if len(clientdata) > 3 and os.path.isfile(clientdata[3]):
+            self.workarea.release(clientdata[1], os.path.getsize(clientdata[3]))
             os.unlink(clientdata[3])
 
         if self.debugmode:
             self._writeToDebugFile(".tar.gz file - {}".format(filename), clientdata)
 
         with tarfile.open(filename, 'w:gz') as f:
-            f.add('.')
+            f.add(clientdata[1], arcname = '.')
         f.close()
 
+        self.workarea.add(clientdata[1], os.path.getsize(filename))
+
         return filename
 
     def _extCheck(self, fname, clientdata):
@@ -130,34 +966,212 @@ class ServerObject:
         if self.debugmode:
             self._writeToDebugFile("Entered _extCheck()", clientdata)
 
-        # List of valid file extensions
-        choices = ('jpg', 'jpeg', 'jpe', 'jp2', 'png', 'bmp', 'dib', 'webp', 'pbm', 'pgm', 'ppm', 'sr', 'ras', 'tiff', 'tif')
+        # List of valid file extensions
+        choices = ('jpg', 'jpeg', 'jpe', 'jp2', 'png', 'bmp', 'dib', 'webp', 'pbm', 'pgm', 'ppm', 'sr', 'ras', 'tiff', 'tif')
+
+        # Get file extension
+        ext = os.path.splitext(fname)[1][1:]
+
+        # Check if extension is valid
+        if ext not in choices:
+            # File Rejected
+
+            self._writeToErrorFile("File does not end with one of {}".format(choices), clientdata)
+            self._send(clientdata)
+
+            return False, False
+
+        return fname.split(".")
+
+    def _extractInWorker(self, imgorig, fname, ext, outdir, url, clientdata):
+        #
+        # Same as _extractPictures() but the pictures are found by one of the
+        # worker processes. Saving/sending the pictures is still done here.
+        #
+
+        if self.debugmode:
+            self._writeToDebugFile("Entered _extractInWorker()", clientdata)
+
+        # Holds the memory mapped files for this image. Always removed, even
+        # if the worker dies, so nothing is left behind in RAM.
+        with self.workarea.request('seg_') as segdir:
+            srcdesc = createSegment(os.path.join(segdir, 'source'), imgorig)
+            self.workarea.add(segdir, os.path.getsize(srcdesc[0]))
+
+            if self.debugmode:
+                grayfilename = outdir + "/"+ fname + "_grayscale." + ext
+            else:
+                grayfilename = None
+
+            with self.workerlock:
+                if self.workerpool is None:
+                    self._startWorkers()
+
+                pool = self.workerpool
+
+            args = (extractWorker, srcdesc, segdir, self.detector, self.returncolor, grayfilename)
+
+            try:
+                try:
+                    future = pool.submit(*args)
+
+                except concurrent.futures.process.BrokenProcessPool:
+                    # A worker process died while the pool was idle. Nothing
+                    # from this request has run yet so start a new pool and
+                    # try again.
+                    with self.workerlock:
+                        if self.workerpool is pool:
+                            pool.shutdown(wait = False)
+                            self._startWorkers()
+
+                        pool = self.workerpool
+
+                    future = pool.submit(*args)
+
+                messages, cards, error = future.result()
+
+            except concurrent.futures.process.BrokenProcessPool:
+                # A worker process died (out of memory, killed, etc) while
+                # working on this image. Start a new pool for the next request.
+                with self.workerlock:
+                    if self.workerpool is pool:
+                        pool.shutdown(wait = False)
+                        self.workerpool = None
+
+                self._writeToErrorFile("Worker process died while processing the image.\n\nURL received: {}".format(url), clientdata)
+                return -1
+
+            except Exception as e:
+                self._writeToErrorFile("Worker process failed to process the image.\nReason: {}\n\nURL received: {}".format(e, url), clientdata)
+                return -1
+
+            if self.debugmode:
+                for text in messages:
+                    self._writeToDebugFile(text, clientdata)
+
+            # The pictures the worker process put in <segdir>
+            self.workarea.add(segdir, sum(os.path.getsize(desc[0]) for loopcnt, desc in cards))
+
+            if grayfilename and os.path.isfile(grayfilename):
+                # Written by the worker process
+                self.workarea.add(clientdata[1], os.path.getsize(grayfilename))
+
+            # Keep track of track of the number of conturs saved to disk
+            numsaved = 0
+
+            for loopcnt, desc in cards:
+
+                # Save each receipe card to individual image files
+                outfilename = outdir + "/"+ fname + "_result_" + str(loopcnt) + "." + ext
+
+                rv = self._saveCard(attachSegment(desc), outfilename, ext, clientdata)
+
+                if self.debugmode:
+                    self._writeToDebugFile("Returned to _extractInWorker()", clientdata)
+
+                if rv is None:
+                    # Lost the connection while streaming the results
+                    return None
+
+                if not rv:
+                    # Unable to save or encode the extracted image
+                    return -1
+
+                numsaved += 1
+
+        if error is not None:
+            # Pictures found before the error are kept, the same as _extractPictures()
+            self._writeToErrorFile("{}\n\nURL received: {}".format(error, url), clientdata)
+            return -1
+
+        return numsaved
+
+    def _extractPictures(self, imgorig, fname, ext, outdir, url, clientdata):
+        #
+        # Finds the pictures in <imgorig> and saves them to <outdir>
+        #
+        # Returns:
+        #   The number of pictures saved
+        #   -1 = An error occurred. Error written to error.txt
+        #   None = Connection to the client was lost while streaming
+
+        if self.debugmode:
+            self._writeToDebugFile("Entered _extractPictures()", clientdata)
+
+        if self.workerprocesses > 0:
+            return self._extractInWorker(imgorig, fname, ext, outdir, url, clientdata)
+
+        if self.debugmode:
+            grayfilename = outdir + "/"+ fname + "_grayscale." + ext
+        else:
+            grayfilename = None
+
+        def log(text):
+            if self.debugmode:
+                self._writeToDebugFile(text, clientdata)
+
+        # Keep track of track of the number of conturs saved to disk
+        numsaved = 0
+
+        try:
+            for loopcnt, image in findPictures(imgorig, self.detector, self.returncolor, grayfilename, log):
+
+                # Save each receipe card to individual image files
+                outfilename = outdir + "/"+ fname + "_result_" + str(loopcnt) + "." + ext
+
+                rv = self._saveCard(image, outfilename, ext, clientdata)
+
+                if self.debugmode:
+                    self._writeToDebugFile("Returned to _extractPictures()", clientdata)
+
+                if rv is None:
+                    # Lost the connection while streaming the results
+                    return None
 
-        # Get file extension
-        ext = os.path.splitext(fname)[1][1:]
+                if not rv:
+                    # Unable to save or encode the extracted image
+                    return -1
 
-        # Check if extension is valid
-        if ext not in choices:
-            # File Rejected
+                numsaved += 1
 
-            self._writeToErrorFile("File does not end with one of {}".format(choices), clientdata)
-            self._send(clientdata)
+        except ExtractError as e:
+            self._writeToErrorFile("{}\n\nURL received: {}".format(e, url), clientdata)
+            numsaved = -1
 
-            return False, False
+        if grayfilename and os.path.isfile(grayfilename):
+            # Written by findPictures()
+            self.workarea.add(clientdata[1], os.path.getsize(grayfilename))
 
-        return fname.split(".")
+        return numsaved
 
     def _parseData(self, data):
 
         if self.debugmode:
             self._writeToDebugFile("Entered _parseData()", '')
 
+        # Options do not carry over from the last request
+        for name, value in self.defaultoptions.items():
+            setattr(self, name, value)
+
         # Find the first url in <data>
         rv = re.search(r'(ftp|http|https)://.*?\.(jpg|jpeg|jpe|jp2|png|bmp|dib|webp|pbm|pgm|ppm|sr|ras|tiff|tif)', data)
-        url = rv.group(0)
 
-        # Remove the url
-        data = data.replace(url, '')
+        if rv is None:
+            # The special URLs do not end with an image file extension
+            rv = re.search(r'http://(helpme|version|status)', data, re.IGNORECASE)
+
+        if rv is None:
+            if self.debugmode:
+                self._writeToDebugFile("No URL found", '')
+
+            # The options are still read so the error is sent the way the
+            # client asked for (keepalive)
+            url = False
+        else:
+            url = rv.group(0)
+
+            # Remove the url
+            data = data.replace(url, '')
 
         # Split <data> into an array in preperation for searching for options
         values = data.split("***")
@@ -171,13 +1185,35 @@ class ServerObject:
             if v == 'debugmodeoff':
                 self.debugmode = False
 
+            if v.startswith('detector'):
+                if v[8:] in DETECTORS:
+                    self.detector = v[8:]
+                else:
+                    self.baddetector = v[8:]
+
             if v == 'debugfileon':
                 self.debugfile = True
 
+            if v == 'dedupon':
+                self.dedup = True
+
+            if v == 'dedupskip':
+                self.dedup = True
+                self.dedupskip = True
+
+            if v == 'profileon':
+                self.profile = True
+
+            if v == 'keepalive':
+                self.keepalive = True
+
             if v == 'returncolor':
                 self.returncolor = True
 
-        if self.debugmode:
+            if v == 'streamon':
+                self.streamresults = True
+
+        if self.debugmode and url:
             self._writeToDebugFile("Parsed URL: {}".format(url), '')
 
         return url
@@ -190,18 +1226,26 @@ class ServerObject:
         if self.debugmode:
             self._writeToDebugFile("Entered _processImage()", clientdata)
 
+        self.streamtar = None
+        self.streamlost = False
+        self.pendinghashes = []
+
+        if self.baddetector is not None:
+            self._writeToErrorFile("Unknown detector: {}\nValid detectors: {}".format(self.baddetector, ', '.join(sorted(DETECTORS))), clientdata)
+            return self._send(clientdata)
+
         # Filename and extension of source image
         fname, ext = self._extCheck(url, clientdata)
 
+        if not ext:
+            # Invalid extension
+            return False
+
         # Full path to source image
         srcimage = clientdata[1] + '/srcimage_' + fname + '.' + ext
 
         clientdata.append(srcimage)
 
-        if not ext:
-            # Invalid extension
-            return False
-
         if self.debugmode:
             self._writeToDebugFile("Returned to _processImage()", clientdata)
 
@@ -239,10 +1283,30 @@ class ServerObject:
             return self._send(clientdata)
 
         # Save image to disk
+        # Read in pieces so a huge file is stopped once it goes over the quota
         with open(srcimage, "wb") as local_file:
-            local_file.write(image.read())
+            while True:
+                chunk = image.read(65536)
+
+                if not chunk:
+                    break
+
+                local_file.write(chunk)
+                self.workarea.add(clientdata[1], len(chunk))
         local_file.close()
 
+        if ext.lower() in ('tif', 'tiff'):
+            # cv2.imread() only loads the first page of a multi-page image
+            try:
+                with Image.open(srcimage) as tiff:
+                    numpages = getattr(tiff, 'n_frames', 1)
+            except (IOError, OSError):
+                # Let cv2.imread() decide if the file is corrupt
+                numpages = 1
+
+            if numpages > 1:
+                return self._processPages(srcimage, numpages, fname, ext, url, clientdata)
+
         # Load in the source image
         imgorig = cv2.imread(srcimage)
 
@@ -254,222 +1318,272 @@ class ServerObject:
         if self.debugmode:
             self._writeToDebugFile("Image loaded.", clientdata)
 
-        # Calculate dimensions for resized image
-        ratio = 500.0 / imgorig.shape[1]
-        dim = (500, int(imgorig.shape[0] * ratio))
+        # Find and save the pictures
+        rv = self._extractPictures(imgorig, fname, ext, clientdata[1], url, clientdata)
 
-        # Resizing of image is done here to speed up processing
-        try:
-            img = cv2.resize(imgorig, dim, interpolation = cv2.INTER_AREA)
-        except Exception as e:
-            msg = "Unable to resize image.\n"
+        if self.debugmode:
+            self._writeToDebugFile("Returned to _processImage()", clientdata)
+
+        if rv is None:
+            # Lost the connection while streaming the results
+            self._cleanUp(clientdata, '')
+            return False
 
-            for a in e:
-                msg += "\n" + str(a)
+        if rv == 0:
+            self._writeToErrorFile("Did not find anything to extract from source image.\n\nURL received: {}".format(url), clientdata)
 
-            msg += "\n\nURL received: {}".format(url)
+        # Free up some of the Raspberry Pi's memory
+        imgorig = None
 
-            if self.debugmode:
-                self._writeToDebugFile(msg + "\nOriginal dimensions: {}x{}\nNew dimensions: {}x{}".format(imgorig.shape[0], imgorig.shape[1], dim[0], dim[1]), clientdata)
+        # Finished processing.
+        # Send the results.
+        return self._send(clientdata)
 
-            self._writeToErrorFile(msg, clientdata)
-            return self._send(clientdata)
+    def _processPages(self, srcimage, numpages, fname, ext, url, clientdata):
+        #
+        # Processes each page of a multi-page image.
+        #
+        # Pages are decoded one at a time and handed to a pool of threads so
+        # only <self.pageworkers> pages are in memory at once. The pictures
+        # from each page are saved to their own folder (page_001, page_002, ...)
+        #
 
         if self.debugmode:
-            self._writeToDebugFile("Image copied and resized.", clientdata)
+            self._writeToDebugFile("Entered _processPages()", clientdata)
+            self._writeToDebugFile("Number of pages: {}".format(numpages), clientdata)
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Page number for each page still being processed
+        pending = {}
 
-        if self.debugmode:
-            # Save the grayscale version to disk
-            grayfilename = clientdata[1] + "/"+ fname + "_grayscale." + ext
+        # Keep track of track of the number of pictures saved to disk
+        numsaved = 0
 
-            try:
-                cv2.imwrite(grayfilename, gray)
-            except Exception as e:
-                # The grayscale image needs to be written to disk
-                # so that the computer does not run out of memory.
+        lost = False
 
-                msg = "Unable to save grayscale image.\nDestination file: {}".format(grayfilename)
+        with Image.open(srcimage) as tiff, concurrent.futures.ThreadPoolExecutor(max_workers = self.pageworkers) as pool:
 
-                for a in e:
-                    msg += "\n"+str(a)
+            for pagenum in range(1, numpages + 1):
 
-                self._writeToDebugFile(msg, clientdata)
+                if len(pending) >= self.pageworkers:
+                    # Wait for a page to finish before loading the next one
+                    done, _ = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
 
-                return self._send(clientdata)
-            else:
-                self._writeToDebugFile("Grayscale image created", clientdata)
+                    for future in done:
+                        del pending[future]
+
+                        rv = future.result()
+                        if rv is None:
+                            lost = True
+                        elif rv > 0:
+                            numsaved += rv
 
-        # Add a blur to remove some of the noise
-        # Image noise is random variation of brightness or color.
-        # More info: https://en.wikipedia.org/wiki/Image_noise
-        gray = cv2.GaussianBlur(gray, (11,11), 0)
+                if lost:
+                    break
 
-        # Find the contours of the receipe cards
-        edge = cv2.Canny(gray, 100, 200)
-        _, contours, _ = cv2.findContours(edge.copy(), 1, 1)
+                try:
+                    tiff.seek(pagenum - 1)
+                    imgorig = cv2.cvtColor(np.asarray(tiff.convert('RGB')), cv2.COLOR_RGB2BGR)
+                except (IOError, OSError, EOFError) as e:
+                    self._writeToErrorFile("Unable to load page {}.\nReason: {}\n\nURL received: {}".format(pagenum, e, url), clientdata)
+                    continue
 
-        if len(contours) < 1:
-            # Unable to pull anything out of the image if no contours were found
-            self._writeToErrorFile("No contours found to retreive\n\nURL received: {}".format(url), clientdata)
-            return self._send(clientdata)
+                if self.debugmode:
+                    self._writeToDebugFile("Page {} loaded.".format(pagenum), clientdata)
+
+                outdir = os.path.join(clientdata[1], 'page_{:03d}'.format(pagenum))
+                os.mkdir(outdir)
+
+                args = (imgorig, fname, ext, outdir, url, clientdata)
+
+                if self.profiler is None:
+                    future = pool.submit(self._extractPictures, *args)
+                else:
+                    # cProfile only sees the thread it was started in
+                    future = pool.submit(self._profileThread, self._extractPictures, *args)
+                pending[future] = pagenum
+
+                # Drop this thread's references so the pool holds the only
+                # one. The page is freed as soon as it has been processed
+                # instead of staying in memory until the next page is loaded.
+                del args
+                imgorig = None
+
+            for future in concurrent.futures.as_completed(pending):
+                rv = future.result()
+                if rv is None:
+                    lost = True
+                elif rv > 0:
+                    numsaved += rv
 
         if self.debugmode:
-            self._writeToDebugFile("Number of contours: {}".format(len(contours)), clientdata)
+            self._writeToDebugFile("Returned to _processPages()", clientdata)
 
-        # Give each output image a unique name
-        loopcnt = -1
+        if lost:
+            # Lost the connection while streaming the results
+            self._cleanUp(clientdata, '')
+            return False
 
-        # Keep track of track of the number of conturs saved to disk
-        numsaved = 0
+        if numsaved < 1:
+            self._writeToErrorFile("Did not find anything to extract from source image.\n\nURL received: {}".format(url), clientdata)
 
-        # Process all found contours
-        for pos in contours:
+        # Finished processing.
+        # Send the results.
+        return self._send(clientdata)
 
-            loopcnt+=1
+    def _profileThread(self, func, *args):
+        # Runs func(*args) under its own profiler. Used for the threads
+        # started by _processPages() while profiling.
 
-            if self.debugmode:
-                self._writeToDebugFile("Loop: {}".format(loopcnt), clientdata)
+        profiler = cProfile.Profile()
+        self.threadprofiles.append(profiler)
 
-            # Each receipe card has two contours. Don't know why.
-            #
-            # The first contour is an exact copy of the card in the original image.
-            # The second contour is rotated slightly and has a small border that makes
-            #     it easier for the OCR script to find the text near the edge of the image.
-            #
-            # This if..then skips the first contour.
-            if loopcnt % 2 == 0: continue
+        profiler.enable()
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
 
-            # Get length of the contour in pixels
-            # <peri> is a float
-            peri = cv2.arcLength(pos, True)
+    def _receive(self, sock):
+        # Returns:
+        #   The URL of the next request from <sock>
+        #   '' = Client disconnected
+        #   None = The whole request has not arrived yet
+        #   False = The request does not contain a URL
 
-            # Approximates a polygonal curve(s) with the specified precision
-            # More info: https://docs.opencv.org/2.4/modules/imgproc/doc/structural_analysis_and_shape_descriptors.html#approxpolydp
-            approx = cv2.approxPolyDP(pos, 0.02 * peri, True)
+        if self.debugmode:
+            self._writeToDebugFile("Entered _receive()", '')
 
-            # Find the corners and dimensions of the object
-            w, h, arr = self._transform(approx, clientdata)
+        endmarker = self._endmarker.encode('utf-8')
 
-            if self.debugmode:
-                self._writeToDebugFile("Returned to _processImage()", clientdata)
+        # May already hold the next request if the client sent several at once
+        if endmarker not in self.recvbuffers[sock]:
 
-            if w == -1 and h == -1 and arr == -1:
-                # An error ocurred in _transform()
-                return self._send(clientdata)
+            # Get data from client
+            # Only called when select() says there is data, so this does not block
+            try:
+                received = sock.recv(1024)
+            except socket.error:
+                received = b''
 
-            # Only process contours that have a valid dimension
-            if w > 0 and h > 0:
+            if not received:
+                # Client disconnected
+                return ''
 
-                # Adjust width and height to match dimensions of
-                # each receipe card on the original image
-                wr = int(w / ratio)
-                hr = int(h / ratio)
+            self.recvbuffers[sock] += received
 
-                # Adjust pixel coordinates to match orignal image
-                arr_us=[]
-                for a in arr:
-                    a[0] = int(math.floor(a[0] / ratio))
-                    a[1] = int(math.floor(a[1] / ratio))
-                    arr_us.append(list(a))
+            if endmarker not in self.recvbuffers[sock]:
+                # Wait for the rest of the request. The connection is still
+                # closed if the rest does not arrive within self.idletimeout.
+                return None
 
-                arr = arr_us
+        # Keep anything after the end marker for the next call
+        message, self.recvbuffers[sock] = self.recvbuffers[sock].split(endmarker, 1)
 
-                # Convert all of the numbers to floats
-                pts1 = np.float32(arr)
-                pts2 = np.float32([[0, 0], [wr, 0], [0, hr], [wr, hr]])
+        # Convert to string
+        data = str(message, encoding='utf-8', errors='replace')
 
-                # Changes perspective to a top-down view (a.k.a.: birds eye view)
-                M = cv2.getPerspectiveTransform(pts1, pts2)
-                dst = cv2.warpPerspective(imgorig, M, (wr, hr))
+        url = self._parseData(data)
 
-                if self.returncolor:
-                    # Keep original image colors in output images
-                    image = dst
-                else:
-                    # Convert output images to grayscale before saving
-                    image = cv2.cvtColor(dst, cv2.COLOR_BGR2GRAY)
+        if self.debugmode:
+            self._writeToDebugFile("Returned to _receive()", '')
 
-                # Save each receipe card to individual image files
-                outfilename = clientdata[1] + "/"+ fname + "_result_" + str(loopcnt) + "." + ext
+        return url
 
-                try:
-                    # WARNING: This will overwrite existing files.
-                    cv2.imwrite(outfilename, image)
+    def _saveCard(self, image, outfilename, ext, clientdata):
+        # Save an extracted picture to disk or, if streaming, send it to the client
+        #
+        # Returns:
+        #   True = Picture saved/sent
+        #   False = Unable to save/encode the picture. Error written to error.txt
+        #   None = Connection to the client was lost while streaming
 
-                except Exception as e:
-                    msg = "Unable to save extracted image to disk."
+        if self.debugmode:
+            self._writeToDebugFile("Entered _saveCard()", clientdata)
 
-                    for a in e:
-                        msg += "\n"+str(a)
+        # Hash of the picture if it has not been seen before
+        h = None
 
-                    if self.debugmode:
-                        self._writeToDebugFile(msg + "\nDestination file: {}".format(outfilename), clientdata)
+        if self.dedup:
+            # Pages of a multi-page image are processed at the same time
+            with self.savelock:
+                h, skip = self._checkDuplicate(image, outfilename, clientdata)
 
-                    self._writeToErrorFile(msg, clientdata)
-                    return self._send(clientdata)
+                if skip:
+                    # Already sent this picture
+                    return True
+
+        if not self.streamresults:
+            try:
+                # WARNING: This will overwrite existing files.
+                written = cv2.imwrite(outfilename, image)
+
+            except Exception as e:
+                msg = "Unable to save extracted image to disk.\n{}".format(e)
 
-                numsaved += 1
-            else:
                 if self.debugmode:
-                    self._writeToDebugFile("\nContur width and/or height are to small to process.", clientdata)
+                    self._writeToDebugFile(msg + "\nDestination file: {}".format(outfilename), clientdata)
 
-        if numsaved < 1:
-            self._writeToErrorFile("Did not find anything to extract from source image.\n\nURL received: {}".format(url), clientdata)
+                self._writeToErrorFile(msg, clientdata)
+                return False
 
-        # Free up some of the Raspberry Pi's memory
-        imgorig = None
+            if not written:
+                # imwrite() reports some failures by returning False instead of raising
+                self._writeToErrorFile("Unable to save extracted image to disk.\nDestination file: {}".format(os.path.basename(outfilename)), clientdata)
+                return False
 
-        # Finished processing.
-        # Send the results.
-        return self._send(clientdata)
+            self.workarea.add(clientdata[1], os.path.getsize(outfilename))
 
-    def _receive(self, sock):
-        total_data=[];
-        data=''
+            if h is not None:
+                # Added to the hash index once the results have been sent
+                with self.savelock:
+                    self.pendinghashes.append(h)
 
-        if self.debugmode:
-            self._writeToDebugFile("Entered _receive()", '')
+            return True
 
-        while True:
+        # Encode the picture in memory so it never touches the disk
+        rv, buf = cv2.imencode('.' + ext, image)
 
-            # Get data from client
-            data = sock.recv(1024)
+        if not rv:
+            self._writeToErrorFile("Unable to encode extracted image.\nDestination file: {}".format(os.path.basename(outfilename)), clientdata)
+            return False
 
-            # Convert to string
-            data = str(data, encoding='utf-8')
+        data = buf.tobytes()
 
-            if self._endmarker in data:
-                # Received entire message.
+        info = tarfile.TarInfo('./' + os.path.relpath(outfilename, clientdata[1]))
+        info.size = len(data)
+        info.mtime = time.time()
 
-                # Removes self._endmarker from the data
-                total_data.append(data[:data.find(self._endmarker)])
-                break
-            else:
-                # Only got part of the message
-                total_data.append(data)
+        with self.savelock:
+            if self.streamlost:
+                # Another page already found out the client is gone
+                return None
 
-            if len(total_data) > 1:
-                #check if self._endmarker got split during transmission
-                last_pair = total_data[-2] + total_data[-1]
+            try:
+                if self.streamtar is None:
+                    # First picture found. Start sending the .tar.gz file.
+                    self.streamtar = tarfile.open(fileobj=SocketWriter(clientdata[0]), mode='w:gz')
 
-                if self._endmarker in last_pair:
-                    total_data[-2] = last_pair[:last_pair.find(self._endmarker)]
-                    total_data.pop()
-                    break
+                self.streamtar.addfile(info, io.BytesIO(data))
 
+                # Push the compressed data out to the client now instead of
+                # waiting for zlib to fill its buffer
+                self.streamtar.fileobj.flush(zlib.Z_SYNC_FLUSH)
 
-        # Put all of the received data into one long string
-        data = ''.join(total_data)
+            except socket.error:
+                # Connection unexpectedly terminated
+                # The caller cleans up once every page has stopped
+                self.streamtar = None
+                self.streamlost = True
+                return None
 
-        url = self._parseData(data)
+            if h is not None:
+                # Added to the hash index once the results have been sent
+                self.pendinghashes.append(h)
 
         if self.debugmode:
-            self._writeToDebugFile("Returned to _receive()", '')
+            self._writeToDebugFile("Streamed {}".format(info.name), clientdata)
 
-        return url
+        return True
 
     def _send(self, clientdata):
         # Create and then send the .tar.gz file
@@ -477,6 +1591,14 @@ class ServerObject:
         if self.debugmode:
             self._writeToDebugFile("Entered _send()", clientdata)
 
+        if self.profiler is not None:
+            # Stop profiling before the results are packed up
+            self._stopProfile(clientdata)
+
+        if self.streamtar is not None:
+            # Part of the .tar.gz file has already been sent
+            return self._sendStreamEnd(clientdata)
+
         filename = self._createGzipFile(clientdata)
 
         if self.debugmode:
@@ -493,6 +1615,7 @@ class ServerObject:
                 except socket.error:
                     # Connection unexpectedly terminated
                     # Clean up
+                    self._commitHashes(False)
                     self._cleanUp(clientdata, filename)
                     return False
 
@@ -507,6 +1630,8 @@ class ServerObject:
             #       is printed after the file has been sent to the client.
             print("Debug: Sent file")
 
+        self._commitHashes(True)
+
         self._cleanUp(clientdata, filename)
 
         if self.debugmode:
@@ -516,6 +1641,42 @@ class ServerObject:
 
         return True
 
+    def _sendError(self, text, clientdata):
+        # Send <text> in error.txt after something went wrong while processing
+
+        if len(clientdata) < 4:
+            # Failed before _processImage() added the source image name
+            clientdata.append('')
+
+        # Get rid of the pictures that were already saved, they may be incomplete
+        for name in os.listdir(clientdata[1]):
+            path = os.path.join(clientdata[1], name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors = True)
+            elif name not in ('debug.txt', 'error.txt'):
+                os.unlink(path)
+
+        # Only debug.txt and error.txt are left and they are not counted
+        self.workarea.release(clientdata[1])
+
+        if self.streamtar is None:
+            # The client will not get the pictures that were just deleted so
+            # they must not be added to the hash index. Pictures that were
+            # already streamed have been delivered and keep their hashes.
+            self._commitHashes(False)
+
+        self._writeToErrorFile(text, clientdata)
+
+        try:
+            return self._send(clientdata)
+        except socket.error:
+            # Connection unexpectedly terminated
+            return False
+        except QuotaExceeded as e:
+            # Not even error.txt fits. Nothing can be sent.
+            print("Error: {}".format(e))
+            return False
+
     def _sendSpecial(self, clientdata, filename):
         # Create and then send the .tar.gz file
 
@@ -556,6 +1717,50 @@ class ServerObject:
 
         return True
 
+    def _sendStreamEnd(self, clientdata):
+        # Send the files that were left on disk (error.txt, debug.txt, etc)
+        # and finish the .tar.gz file that _saveCard() started streaming
+
+        if self.debugmode:
+            self._writeToDebugFile("Entered _sendStreamEnd()", clientdata)
+
+        # Delete the source image since they already have access to it elsewhere
+        if len(clientdata) > 3 and os.path.isfile(clientdata[3]):
+            os.unlink(clientdata[3])
+
+        tar = self.streamtar
+        self.streamtar = None
+
+        try:
+            for name in sorted(os.listdir(clientdata[1])):
+                tar.add(os.path.join(clientdata[1], name), arcname='./' + name)
+
+            # Writes the end of archive marker and the gzip trailer
+            tar.close()
+
+        except socket.error:
+            # Connection unexpectedly terminated
+            # Clean up
+            self._commitHashes(False)
+            self._cleanUp(clientdata, '')
+            return False
+
+        if self.debugmode:
+            # Note: This line will never be seen in debug.txt because it
+            #       is printed after the file has been sent to the client.
+            print("Debug: Sent file")
+
+        self._commitHashes(True)
+
+        self._cleanUp(clientdata, '')
+
+        if self.debugmode:
+            # Note: This line will never be seen in debug.txt because it
+            #       is printed after the file has been deleted.
+            print("Debug: Deleted data")
+
+        return True
+
     def _specialURLs(self, url, clientdata):
         # Special URLs allow the client to retrieve a help/description file and
         # the scripts version number
@@ -568,6 +1773,9 @@ class ServerObject:
         #
         # http://version
         #   Sends a text file containing only the scripts version number
+        #
+        # http://status
+        #   Sends a text file showing how much of the working area is in use
 
         url = url.lower()
 
@@ -596,6 +1804,11 @@ class ServerObject:
                 f.write("\n        Generates the help file you are currently reading. Includes script version number.")
                 f.write("\n\n    http://version")
                 f.write("\n        Sends a text file containing only the scripts version number.")
+                f.write("\n\n    http://status")
+                f.write("\n        Sends a text file showing how much of the working area is in use.")
+                f.write("\n\nWorking Area:")
+                for line in self.workarea.status():
+                    f.write("\n    " + line)
                 f.write("\n\nWhy I wrote this script:")
                 f.write("\n    My mom has alot of receipes hand written on 3\"x5\" index cards. She also has alot of receipes cut out of magazines")
                 f.write("\n    and newspapers glued onto index cards. With most of these cards over 10 years old, the hand writing is starting to")
@@ -643,104 +1856,166 @@ class ServerObject:
             # URL is a special URL    
             return True
 
+        elif url == 'http://status':
+            filename = clientdata[1]+'/status.txt'
+            with open(filename, 'w') as f:
+                f.write("images_findpip Server v{}\n\n".format(self.serverversion))
+                for line in self.workarea.status():
+                    f.write(line + "\n")
+            f.close()
+
+            self._sendSpecial(clientdata, filename)
+
+            # URL is a special URL
+            return True
+
         # URL is not a special URL
         return False
 
-    def _transform(self, pos, clientdata):
-        # This function is used to find the corners and dimensions of the object
+    def _startProfile(self):
+        # Start profiling the current request
+
+        self.threadprofiles = []
+        self.profilestart = time.time()
+
+        tracemalloc.start()
+
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def _startWorkers(self):
+        # Starts the pool of worker processes
 
         if self.debugmode:
-            self._writeToDebugFile("Entered _transform()", clientdata)
+            self._writeToDebugFile("Starting {} worker processes".format(self.workerprocesses), '')
 
-        pts=[]
-        n=len(pos)
+        self.workerpool = concurrent.futures.ProcessPoolExecutor(max_workers = self.workerprocesses)
 
-        for i in range(n):
-            pts.append(list(pos[i][0]))
+        # The processes are only started when the pool is first used.
+        # Give each one something to do so they all start now.
+        for f in [self.workerpool.submit(os.getpid) for i in range(self.workerprocesses)]:
+            f.result()
 
-        sums={}
-        diffs={}
-        tl=tr=bl=br=0
+    def _stopProfile(self, clientdata):
+        # Stop profiling the current request and, unless clientdata == '',
+        # write the results to the directory that will be sent to the client
 
-        for i in pts:
-            x=i[0]
-            y=i[1]
-            sum=x+y
-            diff=y-x
-            sums[sum]=i
-            diffs[diff]=i
+        self.profiler.disable()
 
-        sums=sorted(sums.items())
-        diffs=sorted(diffs.items())
-        n=len(sums)
+        elapsed = time.time() - self.profilestart
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
 
-        try:
-            rect=[sums[0][1],diffs[0][1],diffs[n-1][1],sums[n-1][1]]
-            #       top-left   top-right   bottom-left   bottom-right
-        except IndexError as e:
-            msg = ''
-            for a in e:
-                msg += str(a) + "\n"
+        profiler = self.profiler
+        self.profiler = None
 
-            self._writeToErrorFile(msg, clientdata)
-            return int(-1), int(-1), int(-1)
+        if clientdata == '':
+            return
+
+        if self.debugmode:
+            self._writeToDebugFile("Entered _stopProfile()", clientdata)
+
+        # Combine the request thread with the page threads
+        stats = pstats.Stats(profiler)
+        for p in self.threadprofiles:
+            stats.add(p)
+
+        numthreads = len(self.threadprofiles)
+        self.threadprofiles = []
+
+        stats.dump_stats(clientdata[1]+'/profile.pstats')
 
-        h1 = np.sqrt((rect[0][0]-rect[2][0])**2 + (rect[0][1]-rect[2][1])**2)        #height of left side
-        h2 = np.sqrt((rect[1][0]-rect[3][0])**2 + (rect[1][1]-rect[3][1])**2)        #height of right side
-        h = max(h1, h2)
+        with open(clientdata[1]+'/profile.txt', 'w') as f:
+            f.write("Wall clock time: {:.3f} seconds\n".format(elapsed))
+            f.write("Page threads profiled: {}\n".format(numthreads))
+            if self.workerprocesses > 0:
+                f.write("Note: Time spent in the worker processes shows up as waiting on a future.\n")
+            f.write("\n")
 
-        w1 = np.sqrt((rect[0][0]-rect[1][0])**2 + (rect[0][1]-rect[1][1])**2)        #width of upper side
-        w2 = np.sqrt((rect[2][0]-rect[3][0])**2 + (rect[2][1]-rect[3][1])**2)        #width of lower side
-        w = max(w1, w2)
+            stats.stream = f
+            stats.sort_stats('cumulative').print_stats(50)
+        f.close()
+
+        # OpenCV functions are C functions so cProfile already timed every call.
+        # Depending on the OpenCV version they are listed as '<resize>',
+        # '<built-in method resize>' or '<built-in method cv2.resize>'.
+        cvcalls = []
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+            if func[0] != '~':
+                # Not a C function
+                continue
+
+            name = func[2].strip('<>').replace('built-in method ', '').replace('cv2.', '')
+
+            if callable(getattr(cv2, name, None)):
+                cvcalls.append((tt, nc, 'cv2.' + name))
 
-        return int(w), int(h), rect
+        with open(clientdata[1]+'/profile_opencv.txt', 'w') as f:
+            f.write("{:>10} {:>12} {:>12}  {}\n".format('Calls', 'Total (ms)', 'Per call (ms)', 'Function'))
+            for tt, nc, name in sorted(cvcalls, reverse = True):
+                f.write("{:>10} {:>12.3f} {:>12.3f}  {}\n".format(nc, tt * 1000.0, tt * 1000.0 / nc, name))
+        f.close()
+
+        with open(clientdata[1]+'/memory.txt', 'w') as f:
+            f.write("Peak traced memory: {:.1f} KiB\n".format(peak / 1024.0))
+            f.write("Traced memory at end of request: {:.1f} KiB\n".format(current / 1024.0))
+            f.write("\nLargest allocations still held at end of request:\n")
+            for stat in snapshot.statistics('lineno')[:25]:
+                f.write("{}\n".format(stat))
+        f.close()
 
     def _writeToDebugFile(self, text, clientdata):
 
-        if clientdata == '':
-            # Store in a list until we know what file to write it to
-            self.debuglog.append(text)
+        with self.loglock:
+            if clientdata == '':
+                # Store in a list until we know what file to write it to
+                self.debuglog.append(text)
 
-        else:
+            else:
 
-            if self.debugfile:
-                # Write debug messages to debug.txt
-                # This file will only be created if debugfile == True
+                if self.debugfile:
+                    # Write debug messages to debug.txt
+                    # This file will only be created if debugfile == True
 
-                with open(clientdata[1]+'/debug.txt', 'a') as f:
+                    with open(clientdata[1]+'/debug.txt', 'a') as f:
 
-                    if self.debugmode and len(self.debuglog) > 0:
-                        # Save debug logs generated this file was available for writing
-                        for d in self.debuglog:
-                            f.write(str(d)+"\n")
+                        if self.debugmode and len(self.debuglog) > 0:
+                            # Save debug logs generated this file was available for writing
+                            for d in self.debuglog:
+                                f.write(str(d)+"\n")
 
-                        # Clear the log so it does not get written to
-                        # the file multiple times
-                        self.debuglog = []
+                            # Clear the log so it does not get written to
+                            # the file multiple times
+                            self.debuglog = []
 
-                    f.write(str(text)+"\n")
-                f.close()
+                        f.write(str(text)+"\n")
+                    f.close()
 
-        # Always display message on screen
-        print("Debug: {}".format(text))
+            # Always display message on screen
+            print("Debug: {}".format(text))
 
     def _writeToErrorFile(self, text, clientdata):
         # Write error message to error.txt
 
-        print("Debug: Entered _writeToErrorFile()")
+        with self.loglock:
+            print("Debug: Entered _writeToErrorFile()")
 
-        with open(clientdata[1]+'/error.txt', 'a') as f:
-            f.write(str(text)+"\n")
-        f.close()
+            with open(clientdata[1]+'/error.txt', 'a') as f:
+                f.write(str(text)+"\n")
+            f.close()
 
-        # Always display message on screen
-        print("Error: {}".format(text))
+            # Always display message on screen
+            print("Error: {}".format(text))
 
     def close(self):
         # Close connections and stop server
 
         for sock in self.socklist:
-            sock.close
+            sock.close()
+
+        if self.workerpool is not None:
+            self.workerpool.shutdown()
 
     def run(self):
         #
@@ -761,8 +2036,34 @@ class ServerObject:
 
                 self._writeToDebugFile("select.select() waiting...", '')
 
+            # Clients that already sent another request do not need to wait
+            ready = [sock for sock in self.socklist if self._endmarker.encode('utf-8') in self.recvbuffers.get(sock, b'')]
+
+            # Wake up in time to sweep the working area and close idle connections
+            timeout = self.workarea.timeUntilSweep()
+            for sock, last in self.lastactive.items():
+                timeout = min(timeout, max(0, last + self.idletimeout - time.time()))
+
+            if ready:
+                timeout = 0
+
             # Await an event on a readable socket descriptor
-            (sread, swrite, sexc) = select.select(self.socklist, [], [])
+            (sread, swrite, sexc) = select.select(self.socklist, [], [], timeout)
+
+            sread = sread + [sock for sock in ready if sock not in sread]
+
+            if self.workarea.timeUntilSweep() <= 0:
+                removed = self.workarea.sweep()
+
+                if self.debugmode:
+                    self._writeToDebugFile("Removed {} orphaned files/folders".format(removed), '')
+
+            for sock, last in list(self.lastactive.items()):
+                if sock not in sread and time.time() - last >= self.idletimeout:
+                    if self.debugmode:
+                        self._writeToDebugFile("Closing idle connection", '')
+
+                    self._closeConnection(sock)
 
             # Iterate through the tagged read socklist
             for sock in sread:
@@ -783,46 +2084,88 @@ class ServerObject:
                     if self.debugmode:
                         self._writeToDebugFile("Returned to run()", '')
 
-                    if rv != False:
+                    if rv is None:
+                        # The rest of the request has not arrived yet
+                        pass
 
-                        # Check to see if the peer socket closed
-                        if rv == '':
-                            # Client disconnected
-                            sock.close
-                            self.socklist.remove(sock)
+                    elif rv == '':
+                        # Client disconnected
+                        self._closeConnection(sock, shutdown = False)
+
+                    else:
+                        # Received some data so try to process it as an image
+
+                        self.requestcount[sock] += 1
+
+                        if self.keepalive:
+                            # Frame the response so the client knows where it ends
+                            client = FramedSocket(sock)
                         else:
-                            # Received some data so try to process it as an image
+                            client = sock
 
-                            tempdir = tempfile.mkdtemp()
-                            clientdata = [sock, tempdir, list(os.path.split(tempdir))[-1:][0]]
+                        # The working directory is always removed at the end of
+                        # the with-block, even if processing fails
+                        with self.workarea.request() as tempdir:
+                            clientdata = [client, tempdir, list(os.path.split(tempdir))[-1:][0]]
                                                          # .tar.gz file name - Note the nested list calls
 
-                            if not self._specialURLs(rv, clientdata):
-                                # No special URL received so process the data as an image
-                                self._processImage(rv, clientdata)
-
-                            # Close the connection
                             try:
-                                sock.shutdown(socket.SHUT_RDWR)
-                            except socket.error as e:
-                                print("Debug: Connection closed unexpectedly")
-                                print("Reason: {}".format(e))
-                            else:
-                                sock.close
-                                print("Debug: Closed connection")
+                                # Refuse the request if the working area is already full
+                                self.workarea.add(tempdir, 0)
 
-                            # Always remove the client info
-                            self.socklist.remove(sock)
+                                if rv is False:
+                                    # Send an error instead of leaving the client waiting
+                                    self._sendError("No URL found in the request.", clientdata)
 
-                    else:
-                        if self.debugmode:
-                            self._writeToDebugFile("rv equals false", clientdata)
+                                elif not self._specialURLs(rv, clientdata):
+                                    # No special URL received so process the data as an image
+
+                                    if self.profile:
+                                        self._startProfile()
+
+                                    self._processImage(rv, clientdata)
+
+                            except QuotaExceeded as e:
+                                self._sendError(str(e), clientdata)
+
+                            except Exception:
+                                # The traceback shows paths on the server so
+                                # it only goes to the console
+                                traceback.print_exc()
+
+                                self._sendError("Unexpected error while processing the image.", clientdata)
+
+                            if self.profiler is not None:
+                                # The results were never sent (lost connection)
+                                self._stopProfile('')
+
+                        keepopen = self.keepalive and self.requestcount[sock] < self.maxrequests
+
+                        if self.keepalive:
+                            try:
+                                # Mark the end of the response
+                                client.finish()
+                            except socket.error:
+                                # Connection unexpectedly terminated
+                                keepopen = False
+
+                        if keepopen:
+                            # Wait for the next request
+                            self.lastactive[sock] = time.time()
                         else:
-                            pass
+                            # Close the connection
+                            self._closeConnection(sock)
 
 
 if __name__ == '__main__':
 
+    # Start worker processes from a separate clean process instead of forking
+    # the server. A replacement pool is started while a request is being
+    # handled, and forking then would copy the open sockets and any locks
+    # held by the page threads into the new workers.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method('forkserver')
+
     try:
         # Start the server
         talk = ServerObject()
@@ -835,6 +2178,103 @@ if __name__ == '__main__':
 ##########
 # Change Log:
 #
+# 0.32.14 (2026-10-19):
+#       The grayscale image and the .tar.gz file now count toward the working
+#       area quotas, and the quotas leave 10% of the disk free
+#
+# 0.32.13 (2026-10-19):
+#       Fixed a TypeError in _saveCard() when cv2.imwrite() raises an exception
+#
+# 0.32.12 (2026-10-19):
+#       _processPages() no longer keeps the last page submitted in memory while
+#       the next page is loaded
+#
+# 0.32.11 (2026-10-19):
+#       A worker process that died between requests no longer makes the next
+#       request fail. The pool is restarted and the image is sent again
+#
+# 0.32.10 (2026-10-19):
+#       _sendError() no longer adds the hashes of the deleted pictures to the
+#       hash index
+#
+# 0.32.9 (2026-10-19):
+#       A request without a URL gets an error.txt file instead of being
+#       treated as a disconnect
+#
+# 0.32.8 (2026-10-19):
+#       _receive() reads at most once each time select() wakes up so a client
+#       that stops halfway through a request no longer blocks the server
+#
+# 0.32.7 (2026-10-19):
+#       WorkArea.sweep() only removes files/folders that have not been changed
+#       for self.sweepinterval seconds
+#
+# 0.32.6 (2026-10-19):
+#       /dev/shm is only used for the working area if it can hold the global
+#       quota, and the quotas are capped at the size of the disk. Unexpected
+#       errors send a short message and print the traceback on the console
+#
+# 0.32.5 (2026-10-19):
+#       WorkArea keeps running totals of the bytes written instead of walking
+#       the folders each time a file is saved. Replaced WorkArea.check() with
+#       WorkArea.add()
+#
+# 0.32.4 (2026-10-19):
+#       Worker processes are started with the 'forkserver' start method so a
+#       pool restarted during a request does not inherit its sockets
+#
+# 0.32.3 (2026-10-19):
+#       Moved finding the pictures into findPictures() which is used by both
+#       _extractPictures() and the worker processes so they give the same
+#       results. Removed function _transform()
+#
+# 0.32.2 (2026-10-19):
+#       Added self.loglock so pages processed at the same time do not mix up
+#       debug.txt, error.txt and the saved debug messages
+#
+# 0.32.1 (2026-10-19):
+#       Pictures are added to the hash index only after the results have been
+#       sent. _saveCard() now checks the return value of cv2.imwrite()
+#
+# 0.32.0 (2026-10-19):
+#       Added option 'keepalive' which frames the results with HTTP/1.1 chunked
+#       encoding and keeps the connection open for more requests. Idle
+#       connections are closed after 30 seconds and after 100 requests.
+#       Options now reset to their default values at the start of each request
+#
+# 0.31.0 (2026-10-19):
+#       Added class WorkArea. Temp files now go in a RAM-backed folder when one is
+#       available, are limited by per-request and global quotas, and are always
+#       removed. Orphaned files are swept on startup and every 10 minutes.
+#       Added special URL http://status
+#
+# 0.30.0 (2026-10-19):
+#       Added option 'profileon' which adds cProfile, OpenCV and tracemalloc
+#       results for the request to the .tar.gz file
+#
+# 0.29.0 (2026-10-19):
+#       Added self.workerprocesses. When set, the pictures are found by a pool of
+#       worker processes. Images are passed to and from the workers through
+#       memory mapped files instead of being pickled
+#
+# 0.28.0 (2026-10-19):
+#       Every page of a multi-page TIFF is now processed. Pages are loaded one
+#       at a time and processed in parallel. Moved the picture extraction out
+#       of _processImage() into _extractPictures()
+#
+# 0.27.0 (2026-10-19):
+#       Added options 'dedupon' and 'dedupskip' which use a persistent index of
+#       perceptual hashes to flag or leave out pictures that have already been sent
+#
+# 0.26.0 (2026-10-19):
+#       Moved contour detection into selectable detector backends. Added the
+#       'threshold', 'adaptive' and 'autocanny' detectors and option
+#       detector<name> to pick one
+#
+# 0.25.0 (2026-10-19):
+#       Added option 'streamon' which sends each picture to the client as soon
+#       as it has been extracted instead of after the whole image is processed
+#
 # 0.24.6 (2018-03-04):
 #       Removed duplicated filename splitting in function _processImage()
 #